@@ -0,0 +1,76 @@
+# Chart rendering. Runs inside the render pool's worker processes, so it only
+# imports what drawing needs (not utils, with its numba kernels and GPT client).
+# matplotlib is loaded on the first chart, so importing this module stays cheap.
+from io import BytesIO
+
+CHART_DPI = 80  # 6x4in at 80dpi covers the 5.5x3.5in slot in the PDF
+
+# One Figure per render worker, cleared between charts, so figure setup and
+# renderer/font caches are paid once per process instead of once per chart
+_chart_fig = None
+
+def _chart_axes():
+    global _chart_fig
+    if _chart_fig is None:
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        matplotlib.rcParams["path.simplify_threshold"] = 1.0
+        matplotlib.rcParams["axes.grid"] = False
+        # Bundled with matplotlib, so text never falls back through the font list
+        matplotlib.rcParams["font.family"] = "DejaVu Sans"
+
+        _chart_fig = Figure(figsize=(6, 4), dpi=CHART_DPI)
+        FigureCanvasAgg(_chart_fig)
+        _chart_fig.add_subplot(111)
+    return _chart_fig, _chart_fig.axes[0]
+
+def warm_up():
+    """
+    Render pool initializer: build the figure and draw some text once, so the
+    font manager and Agg font cache are loaded before the first chart arrives.
+    """
+    fig, ax = _chart_axes()
+    ax.set_title("warm up")
+    fig.canvas.print_png(BytesIO())
+
+def render_chart(df, chart_type, title, x_col, y_col):
+    """Render one chart and return its PNG bytes."""
+    fig, ax = _chart_axes()
+    ax.clear()
+    if chart_type == "bar":
+        grouped = df.groupby(x_col, observed=True)[y_col].mean()
+        ax.bar(grouped.index.astype(str), grouped.to_numpy())
+        ax.set_ylabel(y_col)
+    elif chart_type == "line":
+        if y_col:
+            ax.plot(df[x_col], df[y_col])
+            ax.set_ylabel(y_col)
+        else:
+            # No y: every other column shipped with the chart, labelled in a legend
+            for col in df.columns.drop(x_col):
+                ax.plot(df[x_col], df[col], label=col)
+            ax.legend()
+    elif chart_type == "scatter":
+        ax.scatter(df[x_col], df[y_col])
+        ax.set_ylabel(y_col)
+    elif chart_type == "hist":
+        ax.hist(df[x_col].dropna(), bins=20)
+        ax.set_ylabel("Frequency")
+
+    if chart_type in ("line", "scatter") and df[x_col].dtype.kind == "M":
+        # Matplotlib's default date labels overlap at this width. ax.clear() puts
+        # the default locator and formatter back before the next chart.
+        from matplotlib.dates import ConciseDateFormatter
+        ax.xaxis.set_major_formatter(ConciseDateFormatter(ax.xaxis.get_major_locator()))
+
+    # tick params survive ax.clear(), so set the rotation for every chart
+    ax.tick_params(axis="x", labelrotation=90 if chart_type == "bar" else 0)
+    ax.set_xlabel(x_col)
+    ax.set_title(title)
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.canvas.print_png(buf)
+    return buf.getvalue()
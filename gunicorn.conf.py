@@ -0,0 +1,20 @@
+# Picked up automatically by `gunicorn main:app` when run from this directory
+import multiprocessing
+
+bind = "0.0.0.0:8000"
+# Each worker also starts a render pool of up to 4 processes (see utils._render_pool),
+# so this keeps the total near one process per core rather than five
+workers = max(2, multiprocessing.cpu_count() // 4)
+
+# Requests spend most of their time waiting on OpenAI, so each worker
+# serves several at once on threads
+worker_class = "gthread"
+threads = 8
+
+# GPT calls plus chart rendering can outlast the 30s default
+timeout = 120
+
+
+def post_worker_init(worker):
+    from utils import warm_up
+    warm_up()
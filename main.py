@@ -1,8 +1,10 @@
 from flask import Flask, request, send_file, jsonify
 from flask_cors import CORS
-import os
+import asyncio
+from io import BytesIO
 from datetime import datetime
 from utils import (
+    run_async,
     process_csv_and_get_metrics,
     call_gpt_summary,
     build_pdf,
@@ -14,9 +16,9 @@ from utils import (
 app = Flask(__name__)
 CORS(app)
 
-# Folder for temporary generated files
-OUTPUT_DIR = "output"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+async def summarize_and_chart(metrics, df):
+    """The summary request and chart suggestion/rendering are independent, so overlap them."""
+    return await asyncio.gather(call_gpt_summary(metrics), generate_charts(df, metrics))
 
 @app.route("/api/analyze", methods=["POST"])
 def analyze():
@@ -27,21 +29,21 @@ def analyze():
             return jsonify({"error": "No CSV file uploaded"}), 400
 
         metrics, df = process_csv_and_get_metrics(csv_file)
-        summary_text = call_gpt_summary(metrics)
-        charts = generate_charts(df, OUTPUT_DIR)
+        summary_text, charts = run_async(summarize_and_chart(metrics, df))
 
         week_label = current_week_label()
 
         safe_title = safe_filename(report_title)
-        pdf_path = os.path.join(OUTPUT_DIR, f"{safe_title}_{week_label}.pdf")
 
-        build_pdf(report_title, week_label, metrics, charts, summary_text, pdf_path)
+        # Built in memory: concurrent requests with the same title would clobber a shared file
+        pdf = BytesIO()
+        build_pdf(report_title, week_label, metrics, charts, summary_text, pdf)
+        pdf.seek(0)
 
-        return send_file(pdf_path, mimetype="application/pdf", as_attachment=False)
+        return send_file(
+            pdf, mimetype="application/pdf", as_attachment=False,
+            download_name=f"{safe_title}_{week_label}.pdf"
+        )
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
-
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
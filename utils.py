@@ -1,33 +1,127 @@
 import os
+import re
 import json
 import math
+import string
+import unicodedata
+import hashlib
+import shutil
+import tempfile
+import asyncio
+import bisect
+import functools
+import multiprocessing
+import threading
+import warnings
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import diskcache
+import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import seaborn as sns
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
 from io import BytesIO
-from fpdf import FPDF
 from datetime import datetime
-from dateutil.parser import parse as parse_date  # tolerant date parsing
-from openai import OpenAI
+from charts import render_chart, warm_up as _warm_up_renderer  # matplotlib itself only loads in the render workers
+
+# openai and reportlab are imported where they're used
+
+try:
+    import numbagg  # JIT-compiled, multi-core NaN reductions
+except ImportError:
+    numbagg = None
+
+# numbagg's kernels run on numba's parallel threading layer, and the default
+# (workqueue) layer aborts the process if two threads enter it at once. Server
+# workers serve requests on several threads, so calls into it are serialized.
+_numba_lock = threading.Lock()
+
+# Clients, loops and pools are created lazily, once per server worker process
+# (gunicorn forks workers after importing the app, and none of these survive a fork)
+
+@functools.lru_cache(maxsize=1)
+def get_client():
+    """OpenAI client (reads OPENAI_API_KEY from env) with its own HTTP connection pool."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI()
+
+@functools.lru_cache(maxsize=1)
+def _event_loop():
+    # One long-lived event loop for GPT calls, so the client's connection pool
+    # survives across requests (a fresh asyncio.run() per request would orphan it)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@functools.lru_cache(maxsize=1)
+def _render_pool():
+    # matplotlib state is per-process, so charts render in parallel worker processes.
+    # Spawned rather than forked: numba's worker threads don't survive a fork, and
+    # forked children hang on exit. Capped so N server workers don't each start a
+    # process per core.
+    return ProcessPoolExecutor(
+        max_workers=min(4, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_up_renderer,
+    )
+
+_render_pool_lock = threading.Lock()
+
+def _discard_render_pool(pool):
+    # A pool stays broken once one of its processes dies (OOM kill, segfault), so
+    # replace it. Several request threads can see the same breakage; only the
+    # first replaces it, and it starts the new pool under the lock so racing
+    # threads can't each build (and leak) one.
+    with _render_pool_lock:
+        if _render_pool() is pool:
+            _render_pool.cache_clear()
+            _render_pool()
+    pool.shutdown(wait=False)
+
+def warm_up():
+    """
+    Start a render process, the GPT event loop thread and ReportLab's fonts for this worker.
+    Called from gunicorn's post_worker_init hook, so the first request doesn't wait on any.
+    """
+    from reportlab.pdfbase import pdfmetrics
+
+    _render_pool().submit(int).result()
+    _event_loop()
+    for font in ("Helvetica", "Helvetica-Bold"):
+        pdfmetrics.getFont(font)
+
+def run_async(coro):
+    """Run a coroutine on the shared GPT event loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+GPT_MODEL = "gpt-4o-mini"
 
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas
+# Persistent GPT response cache, so repeated uploads skip the API round-trip
+gpt_cache = diskcache.Cache(os.path.join("output", ".gpt_cache"))
 
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
+def _gpt_cache_key(system_prompt, **parts):
+    """Hash the model, system prompt and the data a prompt is built from."""
+    payload = {"model": GPT_MODEL, "sys": system_prompt, **parts}
+    return hashlib.blake2b(json.dumps(payload, default=str, sort_keys=True).encode()).hexdigest()
 
-# Initialize OpenAI client (reads OPENAI_API_KEY from env)
-client = OpenAI()
+_NON_NUMERIC_RE = re.compile(r"[^\d.\-]")
 
 def clean_numeric(series):
     """Remove currency symbols, commas, %, and convert to float."""
-    return pd.to_numeric(series.replace(r'[^\d.-]', '', regex=True), errors='coerce')
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    if not pd.api.types.is_string_dtype(series.dtype):  # True for object columns too
+        return pd.to_numeric(series, errors="coerce")
+    try:
+        arr = pa.array(series, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # object column mixing strings with other values
+        return pd.to_numeric(series.astype(str).str.replace(_NON_NUMERIC_RE, "", regex=True), errors="coerce")
+    # Arrow's C++ regex kernel strips every value in one pass
+    cleaned = pc.replace_substring_regex(arr, pattern=_NON_NUMERIC_RE.pattern, replacement="")
+    return pd.to_numeric(pd.Series(cleaned.to_numpy(zero_copy_only=False), index=series.index), errors="coerce")
 
 def detect_and_parse_dates(series):
     """Try parsing as dates safely."""
@@ -36,201 +130,299 @@ def detect_and_parse_dates(series):
     except Exception:
         return series
 
-def ask_gpt_for_charts(df):
-    """Ask GPT for chart suggestions based on the dataset."""
-    sample_data = df.head(5).to_dict(orient="records")
-
-    system_prompt = (
-        "You are a data visualization assistant. "
-        "Given dataset column names and sample values, suggest 3-5 charts that would give useful insights. "
-        "Only return valid JSON — no text before or after."
-    )
-
-    user_prompt = {
-        "columns": list(df.columns),
-        "sample_rows": sample_data
-    }
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+# Structured output: the API guarantees replies match this schema (strict mode
+# needs an object root, every property listed as required and no extras)
+CHART_SCHEMA = {
+    "name": "charts",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "charts": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "title": {"type": "string"},
+                        "type": {"type": "string", "enum": ["bar", "line", "scatter", "hist"]},
+                        "x": {"type": "string"},
+                        "y": {"type": ["string", "null"]},
+                    },
+                    "required": ["title", "type", "x", "y"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["charts"],
+        "additionalProperties": False,
+    },
+}
+
+CHART_SYSTEM_PROMPT = (
+    "You are a data visualization assistant. "
+    "Given dataset column names and sample values, suggest 3-5 charts that would give useful insights."
+)
+
+async def ask_gpt_for_charts(columns, preview_json):
+    """Ask GPT for chart suggestions based on the column names and preview rows (JSON string)."""
+    # preview_json is already serialized, so splice it in rather than re-encoding rows
+    user_prompt = f'{{"columns": {json.dumps(columns, default=str)}, "sample_rows": {preview_json}}}'
+
+    key = _gpt_cache_key(CHART_SYSTEM_PROMPT, cols=columns, sample=preview_json)
+    if key in gpt_cache:
+        return gpt_cache[key]
+
+    response = await get_client().chat.completions.create(
+        model=GPT_MODEL,
         temperature=0,
         max_tokens=300,
+        response_format={"type": "json_schema", "json_schema": CHART_SCHEMA},
         messages=[
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": (
-                    f"Dataset info:\n{json.dumps(user_prompt)}\n\n"
-                    "Return a JSON array where each element is an object:\n"
-                    "{'title': str, 'type': 'bar'|'line'|'scatter'|'hist', 'x': str, 'y': str or null}.\n"
-                    "No explanation, only JSON."
-                )
-            }
+            {"role": "system", "content": CHART_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
         ]
     )
 
-    return response.choices[0].message.content.strip()
+    # content is None when the model refuses; don't cache that
+    text = response.choices[0].message.content
+    if text:
+        gpt_cache.set(key, text)
+    return text
 
 
 def parse_chart_suggestions(gpt_text):
-    """Parse GPT's JSON output safely."""
+    """Parse GPT's structured output into the list of chart dicts."""
     try:
-        charts = json.loads(gpt_text)
-        if isinstance(charts, list):
-            return charts
-        else:
-            print("[generate_charts] GPT output was not a list.")
-            return []
-    except json.JSONDecodeError as e:
+        return json.loads(gpt_text)["charts"]
+    except (TypeError, KeyError, json.JSONDecodeError) as e:
+        # Only a refusal or a reply cut off at max_tokens gets here
         print("[generate_charts] GPT suggestion parsing failed:", e)
         return []
 
 # -------------------------
 # Data processing utilities
 # -------------------------
+CSV_BLOCK_BYTES = 8 << 20  # Arrow parses (multi-threaded) one block at a time
+CSV_CHUNK_ROWS = 100_000  # chunk size for the pandas fallback reader
+SAMPLE_ROWS = 10_000  # rows kept in memory for charts and medians
+
+if numbagg is not None:
+    # Compile the kernels at import so the first upload doesn't pay for the JIT
+    for _name in ("nancount", "nanmean", "nanmin", "nanmax"):
+        getattr(numbagg, _name)(np.ones((4, 4)), axis=0)
+    numbagg.nanvar(np.ones((4, 4)), axis=0, ddof=0)
+
+def _spill_to_disk(stream):
+    """Copy an upload stream to a named temp file and return its path."""
+    with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+        shutil.copyfileobj(stream, f, length=CSV_BLOCK_BYTES)
+    return f.name
+
+def _iter_arrow_chunks(source):
+    """Yield the CSV (path or Arrow file) as DataFrames, one Arrow block at a time."""
+    reader = pcsv.open_csv(
+        source, read_options=pcsv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_BYTES)
+    )
+    empty = True
+    for batch in reader:
+        empty = False
+        yield batch.to_pandas(date_as_object=False, split_blocks=True)
+    if empty:
+        # Header-only file: still report its columns
+        yield reader.schema.empty_table().to_pandas()
+
+def _iter_pandas_chunks(path):
+    """Yield the CSV at path as DataFrames of CSV_CHUNK_ROWS rows."""
+    yield from pd.read_csv(path, chunksize=CSV_CHUNK_ROWS)
+
+def _column_moments(A):
+    """Per-column count, mean, M2 (sum of squared deviations), min and max of a 2D array."""
+    if numbagg is not None:
+        with _numba_lock:
+            count = numbagg.nancount(A, axis=0)
+            mean = numbagg.nanmean(A, axis=0)
+            var = numbagg.nanvar(A, axis=0, ddof=0)
+            min_ = numbagg.nanmin(A, axis=0)
+            max_ = numbagg.nanmax(A, axis=0)
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns
+            count = np.count_nonzero(~np.isnan(A), axis=0)
+            mean = np.nanmean(A, axis=0)
+            var = np.nanvar(A, axis=0)
+            min_ = np.nanmin(A, axis=0)
+            max_ = np.nanmax(A, axis=0)
+    return count, mean, var * count, min_, max_
+
+class _RunningMoments:
+    """Welford-style running count/mean/M2/min/max, merged one chunk at a time (Chan et al.)."""
+
+    def __init__(self, ncols):
+        self.count = np.zeros(ncols)
+        self.mean = np.zeros(ncols)
+        self.m2 = np.zeros(ncols)
+        self.min = np.full(ncols, np.nan)
+        self.max = np.full(ncols, np.nan)
+
+    def update(self, A):
+        n_b, mean_b, m2_b, min_b, max_b = _column_moments(A)
+        seen = n_b > 0
+        mean_b = np.where(seen, mean_b, 0.0)
+        m2_b = np.where(seen, m2_b, 0.0)
+
+        n = self.count + n_b
+        safe_n = np.where(n > 0, n, 1)
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * n_b / safe_n
+        self.m2 = self.m2 + m2_b + delta ** 2 * self.count * n_b / safe_n
+        self.count = n
+        self.min = np.fmin(self.min, min_b)
+        self.max = np.fmax(self.max, max_b)
+
+def _as_float_array(df, cols):
+    """2D float64 array of cols, coercing any column a later chunk parsed as text."""
+    frame = df[cols]
+    text_cols = [c for c in cols if not pd.api.types.is_numeric_dtype(frame[c])]
+    if text_cols:
+        frame = frame.copy()
+        for c in text_cols:
+            frame[c] = pd.to_numeric(frame[c], errors="coerce")
+    return frame.to_numpy(dtype="float64", na_value=np.nan)
+
+def _update_reservoir(reservoir, chunk, seen, rng):
+    """
+    Algorithm R over a whole chunk: keep a uniform SAMPLE_ROWS-row sample of every row seen.
+    Rows are indexed by their position in the file, so the sample can be put back in order.
+    """
+    free = SAMPLE_ROWS - len(reservoir)
+    if free > 0:
+        reservoir = pd.concat([reservoir, chunk.iloc[:free]])
+        chunk = chunk.iloc[free:]
+        seen += free
+    if chunk.empty:
+        return reservoir
+
+    # Row number t replaces slot j ~ U[0, t] whenever j lands inside the reservoir
+    slots = rng.integers(0, np.arange(seen, seen + len(chunk)) + 1)
+    rows = np.flatnonzero(slots < SAMPLE_ROWS)
+    if len(rows) == 0:
+        return reservoir
+    # When several rows draw the same slot, the last one wins
+    slots, first = np.unique(slots[rows][::-1], return_index=True)
+    rows = rows[::-1][first]
+    return pd.concat([reservoir.drop(reservoir.index[slots]), chunk.iloc[rows]])
+
+def _downcast(df):
+    """
+    Shrink numeric columns to the smallest safe dtype and low-cardinality text to category.
+    Done on the sample only; the streaming reductions work in float64 anyway.
+    """
+    for col in df.select_dtypes("integer"):
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in df.select_dtypes("float"):
+        df[col] = pd.to_numeric(df[col], downcast="float")
+    for col in df.select_dtypes("object"):
+        if df[col].nunique() / max(len(df), 1) < 0.5:
+            df[col] = df[col].astype("category")
+    return df
+
 def process_csv_and_get_metrics(csv_file):
     """
-    Read CSV (file-like or path). Return (metrics_dict, dataframe).
-    Metrics includes numeric_stats and top_categories for GPT context.
+    Read CSV (file-like or path) in chunks. Return (metrics_dict, sample_dataframe).
+    Metrics includes numeric_stats and top_categories for GPT context and are computed
+    over every row; the dataframe is a uniform sample of up to SAMPLE_ROWS rows in file order.
     """
-    # Accept file-like object or path
+    path = str(csv_file)
     if hasattr(csv_file, "read"):
-        df = pd.read_csv(csv_file)
-    else:
-        df = pd.read_csv(str(csv_file))
-
-    # Basic metrics
-    numeric_cols = df.select_dtypes(include="number").columns.tolist()
+        # Spill uploads to disk once so Arrow can memory-map the file instead of copying it
+        path = _spill_to_disk(getattr(csv_file, "stream", csv_file))
+    try:
+        try:
+            with pa.memory_map(path) as source:
+                return _metrics_from_chunks(_iter_arrow_chunks(source))
+        except pa.ArrowInvalid as e:
+            # Arrow fixes column types from the first block (and rejects quoted newlines);
+            # pandas copes with both, so start over with it
+            print(f"[process_csv_and_get_metrics] Arrow parse failed, retrying with pandas: {e}")
+            return _metrics_from_chunks(_iter_pandas_chunks(path))
+    finally:
+        if hasattr(csv_file, "read"):
+            os.remove(path)
+
+def _metrics_from_chunks(chunks):
+    """Reduce an iterator of DataFrame chunks to (metrics_dict, sample_dataframe)."""
+    rng = np.random.default_rng(0)  # fixed seed: same upload -> same sample and cache keys
+    rows = 0
+    first = None
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(rows, rows + len(chunk))
+        if first is None:
+            # Column roles and the preview come from the first chunk
+            first = chunk
+            numeric_cols = chunk.select_dtypes(include="number").columns.tolist()
+            cat_cols = chunk.select_dtypes(include=["object", "category"]).columns.tolist()
+            moments = _RunningMoments(len(numeric_cols))
+            counters = {col: Counter() for col in cat_cols}
+            reservoir = chunk.iloc[:0]
+
+        if numeric_cols:
+            moments.update(_as_float_array(chunk, numeric_cols))
+        for col in cat_cols:
+            counters[col].update(chunk[col].value_counts(dropna=True).to_dict())
+        reservoir = _update_reservoir(reservoir, chunk, rows, rng)
+        rows += len(chunk)
+
+    sample_df = reservoir.sort_index()
+
+    # Basic metrics (median from the sample: exact up to SAMPLE_ROWS rows, estimated beyond)
     numeric_stats = {}
-    for col in numeric_cols:
-        series = df[col].dropna()
-        if len(series) == 0:
-            continue
-        numeric_stats[col] = {
-            "count": int(series.count()),
-            "mean": float(series.mean()),
-            "median": float(series.median()),
-            "min": float(series.min()),
-            "max": float(series.max()),
-            "std": float(series.std()) if series.count() > 1 else 0.0
-        }
-
-    cat_cols = df.select_dtypes(include=["object", "category"]).columns.tolist()
+    if numeric_cols:
+        A = _as_float_array(sample_df, numeric_cols)
+        # The sample is small enough for numpy; numbagg's nanmedian would cost every
+        # worker a long JIT compile at boot for no gain here
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns
+            median = np.nanmedian(A, axis=0)
+        for i, col in enumerate(numeric_cols):
+            n = moments.count[i]
+            if n == 0:
+                continue
+            numeric_stats[col] = {
+                "count": int(n),
+                "mean": float(moments.mean[i]),
+                "median": float(median[i]),
+                "min": float(moments.min[i]),
+                "max": float(moments.max[i]),
+                "std": math.sqrt(moments.m2[i] / (n - 1)) if n > 1 else 0.0
+            }
+
     top_categories = {}
-    for col in cat_cols:
-        top = df[col].dropna().value_counts().head(5).to_dict()
+    for col, counter in counters.items():
+        top = dict(counter.most_common(5))
         if top:
             top_categories[col] = top
 
     # Try to detect date columns
-    possible_dates = []
-    for col in df.columns:
-        if df[col].dtype == "datetime64[ns]":
+    possible_dates = first.select_dtypes(include=["datetime", "datetimetz"]).columns.tolist()
+    for col in first.select_dtypes(include="object").columns:
+        # try parsing small sample in one vectorized call
+        sample = first[col].dropna().head(20).astype(str)
+        parsed = pd.to_datetime(sample, errors="coerce", format="mixed", dayfirst=False)
+        if parsed.notna().sum() >= max(1, len(sample)//2):
             possible_dates.append(col)
-        elif df[col].dtype == "object":
-            # try parsing small sample
-            sample = df[col].dropna().head(20).astype(str)
-            parsed = 0
-            for s in sample:
-                try:
-                    _ = parse_date(s)
-                    parsed += 1
-                except Exception:
-                    break
-            if parsed >= max(1, len(sample)//2):
-                possible_dates.append(col)
 
     metrics = {
-        "rows": int(len(df)),
-        "columns": list(df.columns),
+        "rows": rows,
+        "columns": list(first.columns),
         "numeric_stats": numeric_stats,
         "top_categories": top_categories,
         "date_columns": possible_dates,
-        "preview": df.head(8).to_dict(orient="records")
     }
-    return metrics, df
-
-# -------------------------
-# GPT-driven suggestions
-# -------------------------
-def _safe_json_load(text):
-    """Try to parse JSON from GPT output robustly."""
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except Exception:
-        # Try extracting JSON substring heuristically
-        start = text.find("[")
-        end = text.rfind("]")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(text[start:end+1])
-            except Exception:
-                pass
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(text[start:end+1])
-            except Exception:
-                pass
-    return None
-
-def suggest_charts_with_gpt(df, max_suggestions=5, sample_size=20):
-    """
-    Ask GPT-4 to suggest up to max_suggestions charts for dataframe df.
-    Returns a list of dicts:
-    {title, type, x, y, agg}
-    """
-    # Sample some rows to keep prompt small
-    sample = df.head(sample_size).to_dict(orient="records")
-    columns = list(df.columns)
-
-    system_prompt = (
-        "You are a data visualization assistant. "
-        "Given dataset columns and sample rows, suggest charts to understand the data. "
-        f"Return JSON list of up to {max_suggestions} items with keys: "
-        "\"title\", \"type\" (histogram, bar, line, scatter, box, pie, timeseries), "
-        "\"x\" (column name or null), \"y\" (column name or null), and \"agg\" (mean, sum, count, or null). "
-        "Return JSON only, no explanations."
-    )
-
-    user_prompt = json.dumps({
-        "columns": columns,
-        "sample_rows": sample,
-        "notes": "Suggest histogram for numeric column, scatter for two numeric, bar for categorical vs numeric, timeseries for dates."
-    }, default=str)
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.2,
-            max_tokens=700
-        )
-        content = response.choices[0].message.content
-        parsed = _safe_json_load(content)
-        if not parsed or not isinstance(parsed, list):
-            return []
-        # Normalize results
-        suggestions = []
-        for item in parsed:
-            if not isinstance(item, dict):
-                continue
-            suggestions.append({
-                "title": item.get("title", "Chart"),
-                "type": item.get("type", "").lower(),
-                "x": item.get("x"),
-                "y": item.get("y"),
-                "agg": item.get("agg")
-            })
-        return suggestions[:max_suggestions]
-    except Exception as e:
-        print(f"[suggest_charts_with_gpt] GPT error: {e}")
-        return []
+    # Serialize the preview once; the GPT prompts reuse the JSON string as-is
+    metrics["_preview_json"] = first.head(8).to_json(orient="records", date_format="iso")
+    metrics["preview"] = json.loads(metrics["_preview_json"])
+    # The sample outlives the request's reductions (it is pickled to every render worker)
+    return metrics, _downcast(sample_df)
 
 # -------------------------
 # Chart generation
@@ -248,68 +440,134 @@ def _ensure_datetime(series):
     except Exception:
         return series
 
-def generate_charts(df, output_dir):
-    """Generate charts dynamically from GPT suggestions."""
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Step 1: Ask GPT for chart suggestions
-    gpt_output = ask_gpt_for_charts(df)
-
-    # Step 2: Parse GPT's JSON safely
-    chart_suggestions = parse_chart_suggestions(gpt_output)
-
-    generated_paths = []
-
-    # Step 3: Generate each chart
+async def _render_charts(jobs):
+    """
+    Run render_chart for each args tuple in the render pool. Returns PNG bytes or the
+    exception for each job, in order. Jobs lost to a dead render process are retried
+    once on a fresh pool.
+    """
+    loop = asyncio.get_running_loop()
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    for attempt in range(2):
+        with _render_pool_lock:
+            pool = _render_pool()
+        futures = {}
+        lost = []
+        for i in pending:
+            try:
+                futures[i] = loop.run_in_executor(pool, render_chart, *jobs[i])
+            except (BrokenProcessPool, RuntimeError) as e:
+                # submit() refuses once the pool is known broken, or once another
+                # request has shut it down to replace it
+                results[i] = e
+                lost.append(i)
+        done = await asyncio.gather(*futures.values(), return_exceptions=True)
+        for i, result in zip(futures, done):
+            results[i] = result
+            if isinstance(result, BrokenProcessPool):
+                lost.append(i)
+        if not lost:
+            break
+        _discard_render_pool(pool)
+        pending = sorted(lost)
+    return results
+
+def _dtype_kind(dtype):
+    # Coarse kinds only: the sample is downcast, so its exact dtypes depend on the
+    # values (int8 vs int16, category vs object) rather than on the schema
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "text"
+
+def _schema_key(df):
+    """(column, kind) pairs identifying a dataframe's schema."""
+    return tuple(zip(map(str, df.columns), map(_dtype_kind, df.dtypes)))
+
+async def generate_charts(df, metrics):
+    """Generate charts dynamically from GPT suggestions. Returns in-memory PNGs (BytesIO)."""
+    # Step 1: Ask GPT for chart suggestions, once per schema: uploads with the same
+    # columns and column kinds (e.g. weekly exports) get the same suggestions
+    # Keyed like the prompt cache (model and prompt included) so a prompt or model
+    # change doesn't keep serving suggestions for schemas seen before it
+    schema_key = _gpt_cache_key(
+        CHART_SYSTEM_PROMPT, memo="chart_suggestions", schema=_schema_key(df), reply=CHART_SCHEMA
+    )
+    chart_suggestions = gpt_cache.get(schema_key)
+    if chart_suggestions is None:
+        gpt_output = await ask_gpt_for_charts(metrics["columns"], metrics["_preview_json"])
+
+        # Step 2: Parse GPT's JSON safely
+        chart_suggestions = parse_chart_suggestions(gpt_output)
+        if chart_suggestions:
+            gpt_cache.set(schema_key, chart_suggestions)
+
+    # Step 3: Render valid charts in parallel
+    titles = []
+    jobs = []
     for chart in chart_suggestions:
-        try:
-            chart_type = chart.get("type")
-            title = chart.get("title", "Untitled Chart")
-            x_col = chart.get("x")
-            y_col = chart.get("y")
+        chart_type = chart.get("type")
+        title = chart.get("title", "Untitled Chart")
+        x_col = chart.get("x")
+        y_col = chart.get("y")
 
-            if x_col not in df.columns or (y_col and y_col not in df.columns):
-                print(f"[generate_charts] Skipping invalid chart: {title}")
-                continue
+        if x_col not in df.columns or (y_col and y_col not in df.columns):
+            print(f"[generate_charts] Skipping invalid chart: {title}")
+            continue
+        if chart_type not in ("bar", "line", "scatter", "hist"):
+            print(f"[generate_charts] Unknown chart type: {chart_type}")
+            continue
 
-            plt.figure(figsize=(6, 4))
-            if chart_type == "bar":
-                df.groupby(x_col)[y_col].mean().plot(kind="bar")
-            elif chart_type == "line":
-                df.plot(x=x_col, y=y_col, kind="line")
-            elif chart_type == "scatter":
-                df.plot.scatter(x=x_col, y=y_col)
-            elif chart_type == "hist":
-                df[x_col].plot(kind="hist", bins=20)
-            else:
-                print(f"[generate_charts] Unknown chart type: {chart_type}")
+        if y_col:
+            y_cols = [y_col] if y_col != x_col else []
+        elif chart_type == "hist":
+            y_cols = []
+        elif chart_type == "line":
+            # No y: plot every numeric column against x, as df.plot(x=x) did
+            y_cols = [c for c in df.select_dtypes(include="number").columns if c != x_col]
+            if not y_cols:
+                print(f"[generate_charts] Skipping line chart with nothing to plot: {title}")
                 continue
+        else:
+            print(f"[generate_charts] Skipping {chart_type} chart without a y column: {title}")
+            continue
 
-            plt.title(title)
-            plt.tight_layout()
-
-            chart_path = os.path.join(output_dir, f"{title.replace(' ', '_')}.png")
-            plt.savefig(chart_path)
-            plt.close()
+        # Only ship the columns this chart needs to the worker process
+        cols = [x_col] + y_cols
+        titles.append(title)
+        jobs.append((df[cols], chart_type, title, x_col, y_col))
 
-            generated_paths.append(chart_path)
+    generated_charts = []
+    results = await _render_charts(jobs)
+    for title, result in zip(titles, results):
+        if isinstance(result, Exception):
+            print(f"[generate_charts] error creating chart '{title}':", result)
+        else:
+            generated_charts.append(BytesIO(result))
 
-        except Exception as e:
-            print(f"[generate_charts] error creating chart '{chart.get('title', 'Untitled')}':", e)
+    return generated_charts
 
-    return generated_paths
 
 
+_FILENAME_KEEP = frozenset("-_.() " + string.ascii_letters + string.digits)
+_FILENAME_DELETE = str.maketrans("", "", "".join(chr(i) for i in range(128) if chr(i) not in _FILENAME_KEEP))
 
 def safe_filename(s):
-    keep = "-_.() %s%s" % (string.ascii_letters, string.digits)
-    return "".join(c for c in s if c in keep).replace(" ", "_")[:100]
+    # Fold accents to ASCII first ("é" -> "e") so the table only has to cover ASCII
+    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode()
+    return s.translate(_FILENAME_DELETE).replace(" ", "_")[:100]
 
 
 # -------------------------
 # GPT summary (plain text)
 # -------------------------
-def call_gpt_summary(metrics):
+async def call_gpt_summary(metrics):
     """
     Use GPT to generate a short plain-text summary of the dataset based on metrics dict.
     Returns a string (not JSON).
@@ -330,9 +588,14 @@ def call_gpt_summary(metrics):
         "notable distributions, and recommendations. Return plain text only."
     )
 
+    # The prompt is built from the metrics, so it identifies the reply
+    key = _gpt_cache_key(system, user=user)
+    if key in gpt_cache:
+        return gpt_cache[key]
+
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+        resp = await get_client().chat.completions.create(
+            model=GPT_MODEL,
             messages=[
                 {"role": "system", "content": system},
                 {"role": "user", "content": user}
@@ -341,6 +604,7 @@ def call_gpt_summary(metrics):
             max_tokens=300
         )
         text = resp.choices[0].message.content.strip()
+        gpt_cache.set(key, text)
         return text
     except Exception as e:
         print(f"[call_gpt_summary] GPT error: {e}")
@@ -349,41 +613,73 @@ def call_gpt_summary(metrics):
 # -------------------------
 # PDF builder (embeds charts)
 # -------------------------
-def build_pdf(report_title, week_label, metrics, charts, summary_text, output_path):
-    """Build PDF with summary and charts."""
-    styles = getSampleStyleSheet()
-    doc = SimpleDocTemplate(output_path, pagesize=A4)
-    story = []
+def build_pdf(report_title, week_label, metrics, charts, summary_text, output):
+    """Build PDF with summary and charts into output (a path or a binary file object)."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch
+    from reportlab.lib.utils import ImageReader, simpleSplit
+    from reportlab.pdfgen.canvas import Canvas
+
+    page_w, page_h = A4
+    margin = 0.75 * inch
+    text_w = page_w - 2 * margin
+    c = Canvas(output, pagesize=A4, pageCompression=1)
+    y = page_h - margin
+
+    def make_room(height):
+        nonlocal y
+        if y - height < margin:
+            c.showPage()
+            y = page_h - margin
+
+    def draw_text(text, font="Helvetica", size=10, leading=14, centered=False):
+        """Draw text wrapped to the page width as measured in this font, keeping blank lines."""
+        nonlocal y
+        for para in str(text).split("\n"):
+            for line in simpleSplit(para, font, size, text_w) or [""]:
+                make_room(leading)
+                # showPage resets the graphics state, so set the font per line
+                c.setFont(font, size)
+                if centered:
+                    c.drawCentredString(page_w / 2, y - size, line)
+                else:
+                    c.drawString(margin, y - size, line)
+                y -= leading
 
     # Title — use report_title instead of agent_name
-    title_text = f"{report_title} - {week_label}"
-    story.append(Paragraph(title_text, styles["Title"]))
-    story.append(Spacer(1, 0.2 * inch))
+    draw_text(f"{report_title} - {week_label}", "Helvetica-Bold", 18, leading=22, centered=True)
+    y -= 0.2 * inch
 
     # Summary Section
-    story.append(Paragraph("<b>AI Summary</b>", styles["Heading2"]))
-    story.append(Paragraph(summary_text, styles["Normal"]))
-    story.append(Spacer(1, 0.3 * inch))
+    draw_text("AI Summary", "Helvetica-Bold", 14, leading=20)
+    draw_text(summary_text.strip())
+    y -= 0.3 * inch
 
     # Dataset Metrics Section
-    story.append(Paragraph("<b>Dataset Overview</b>", styles["Heading2"]))
-    story.append(Paragraph(f"Rows: {metrics.get('rows', 'N/A')}", styles["Normal"]))
+    draw_text("Dataset Overview", "Helvetica-Bold", 14, leading=20)
+    draw_text(f"Rows: {metrics.get('rows', 'N/A')}")
     cols = metrics.get('columns', [])
-    story.append(Paragraph(f"Columns: {', '.join(cols) if cols else 'N/A'}", styles["Normal"]))
-    story.append(Spacer(1, 0.3 * inch))
+    draw_text(f"Columns: {', '.join(cols) if cols else 'N/A'}")
+    y -= 0.3 * inch
 
     # Charts Section
     if charts:
-        story.append(Paragraph("<b>Visualizations</b>", styles["Heading2"]))
+        img_w, img_h = 5.5 * inch, 3.5 * inch
+        # Keep the heading on the same page as the first chart
+        make_room(20 + img_h)
+        draw_text("Visualizations", "Helvetica-Bold", 14, leading=20)
         for chart in charts:
-            chart_path = chart.get("file") if isinstance(chart, dict) else chart
+            # file path, {"file": path} or an in-memory PNG buffer
+            chart_src = chart.get("file") if isinstance(chart, dict) else chart
             try:
-                story.append(Image(chart_path, width=5.5 * inch, height=3.5 * inch))
-                story.append(Spacer(1, 0.3 * inch))
+                image = ImageReader(chart_src)
+                make_room(img_h)
+                c.drawImage(image, (page_w - img_w) / 2, y - img_h, width=img_w, height=img_h)
+                y -= img_h + 0.3 * inch
             except Exception as e:
-                print(f"[build_pdf] Could not add chart {chart_path}: {e}")
+                print(f"[build_pdf] Could not add chart {chart_src}: {e}")
 
-    doc.build(story)
+    c.save()
 
 
 
@@ -391,9 +687,8 @@ def build_pdf(report_title, week_label, metrics, charts, summary_text, output_pa
 # -------------------------
 # small helpers
 # -------------------------
-import string
 def split_long_text(text, width):
-    """Naive splitter preserving paragraphs"""
+    """Greedy word wrap preserving paragraphs; words longer than width are cut."""
     if not text:
         return []
     lines = []
@@ -402,15 +697,21 @@ def split_long_text(text, width):
         if not para:
             lines.append("")
             continue
-        while len(para) > width:
-            # break at last space before width
-            idx = para.rfind(" ", 0, width)
-            if idx <= 0:
-                idx = width
-            lines.append(para[:idx])
-            para = para[idx:].lstrip()
-        if para:
-            lines.append(para)
+        # Find every break point once, then bisect for the last one that fits each line
+        spaces = [m.start() for m in re.finditer(" ", para)]
+        i = 0
+        while len(para) - i > width:
+            k = bisect.bisect_right(spaces, i + width) - 1
+            if k >= 0 and spaces[k] > i:
+                cut = spaces[k]
+            else:
+                cut = i + width  # no space in reach: cut the word
+            lines.append(para[i:cut].rstrip())
+            i = cut
+            while i < len(para) and para[i] == " ":
+                i += 1
+        if i < len(para):
+            lines.append(para[i:])
     return lines
 
 def current_week_label():